@@ -0,0 +1,197 @@
+"""Shared helpers for building Cardano airdrop transactions.
+
+Kept out of app.py because Streamlit re-executes the app script on every
+interaction; functions defined here are compiled once per process and the
+parse_address cache survives reruns.
+"""
+import heapq
+from decimal import Decimal, ROUND_DOWN
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+LOVELACE_PER_ADA = 1_000_000
+MAINNET_ADDRESS_PREFIX = 'addr1'
+REQUIRED_COLUMNS = ('Address', 'ADA Value')
+# Ledger minimum for an ADA-only output to a base address:
+# (160 + 65 bytes) * coinsPerUTxOByte (4310)
+MIN_LOVELACE_PER_OUTPUT = 969_750
+COINS_PER_UTXO_BYTE = 4310
+# Total ADA supply; no single CSV amount can be larger
+MAX_ADA_SUPPLY = 45_000_000_000
+
+def ada_to_lovelace(ada_amount) -> int:
+    """Convert ADA to Lovelace.
+
+    Accepts the amount as CSV text or a number and goes through Decimal, so
+    amounts like 1.1 ADA don't lose a lovelace to float rounding; anything
+    below one lovelace is truncated.
+    """
+    lovelace = Decimal(str(ada_amount).strip()) * LOVELACE_PER_ADA
+    return int(lovelace.to_integral_value(rounding=ROUND_DOWN))
+
+@lru_cache(maxsize=65_536)
+def parse_address(address: str):
+    """Parse a bech32 address, decoding repeated addresses only once."""
+    from pycardano import Address
+    return Address.from_primitive(address)
+
+def validate_csv(df):
+    """Validate the CSV format."""
+    # Check columns exist
+    if not all(col in df.columns for col in REQUIRED_COLUMNS):
+        return False, "CSV must contain 'Address' and 'ADA Value' columns"
+    
+    # Validate addresses
+    invalid_addresses = ~df['Address'].astype(str).str.startswith(MAINNET_ADDRESS_PREFIX)
+    num_invalid = int(invalid_addresses.sum())
+    if num_invalid:
+        examples = ', '.join(df.loc[invalid_addresses, 'Address'].fillna('(empty)').astype(str).head(3))
+        return False, f"Found {num_invalid} invalid addresses (e.g. {examples}). All addresses must start with '{MAINNET_ADDRESS_PREFIX}'"
+    
+    # Validate ADA amounts; anything unparseable becomes NaN
+    ada_text = df['ADA Value'].astype(str)
+    ada_values = pd.to_numeric(ada_text, errors='coerce')
+    if not np.isfinite(ada_values).all():
+        return False, "ADA Value column must contain valid numbers"
+    if (ada_values <= 0).any():
+        return False, "All ADA values must be positive"
+    if (ada_values > MAX_ADA_SUPPLY).any():
+        return False, "ADA values cannot exceed the 45B ADA max supply"
+    # Exact lovelace from the original text, without a float round trip
+    try:
+        lovelace = ada_text.map(ada_to_lovelace).astype('int64')
+    except (ArithmeticError, ValueError):
+        return False, "ADA Value column must contain valid numbers"
+    df['ADA Value'] = ada_values
+    df['Lovelace'] = lovelace
+
+    return True, "CSV validation passed"
+
+def _select_exact_match(utxos, total_needed, max_tries=100_000):
+    """Branch-and-bound search for UTXOs summing to exactly total_needed.
+
+    An exact match needs no change output at all. UTXOs are explored
+    largest first, and a branch is pruned as soon as it overshoots or the
+    remaining UTXOs can no longer reach the target. Returns None if no match
+    is found within max_tries steps.
+    """
+    utxos = sorted(utxos, key=lambda utxo: utxo.output.amount.coin, reverse=True)
+    coins = [utxo.output.amount.coin for utxo in utxos]
+    # remaining[i] is the most that utxos[i:] can still add
+    remaining = [0] * (len(coins) + 1)
+    for i in range(len(coins) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + coins[i]
+    
+    picked = []
+    total = 0
+    i = 0
+    for _ in range(max_tries):
+        if total == total_needed:
+            return [utxos[j] for j in picked]
+        if i < len(coins) and total + remaining[i] >= total_needed:
+            if total + coins[i] <= total_needed:
+                picked.append(i)
+                total += coins[i]
+            i += 1
+            continue
+        # Dead end: drop the last UTXO taken and try the branch without it,
+        # skipping equal-valued UTXOs that would lead to the same sums
+        if not picked:
+            return None
+        j = picked.pop()
+        total -= coins[j]
+        i = j + 1
+        while i < len(coins) and coins[i] == coins[j]:
+            i += 1
+    return None
+
+def min_change_lovelace(utxos):
+    """Smallest amount the change output for spending utxos may hold.
+
+    ADA-only change needs the plain output minimum; change that carries
+    tokens needs more, per the ledger's (160 + output size) *
+    coinsPerUTxOByte rule.
+    """
+    values = [utxo.output.amount for utxo in utxos]
+    if not any(value.multi_asset for value in values):
+        return MIN_LOVELACE_PER_OUTPUT
+    
+    from pycardano import TransactionOutput
+    change_value = sum(values[1:], values[0])
+    # The whole selected coin as the amount gives an upper bound on its
+    # encoded size; post_alonzo matches the larger map-style encoding
+    change_output = TransactionOutput(utxos[0].output.address, change_value, post_alonzo=True)
+    return max(MIN_LOVELACE_PER_OUTPUT, (160 + len(change_output.to_cbor())) * COINS_PER_UTXO_BYTE)
+
+def is_valid_change(utxos, change):
+    """Whether change lovelace can be returned from spending utxos.
+
+    Change can be left out entirely only if it is 0 and no tokens need
+    returning; otherwise it must meet min_change_lovelace.
+    """
+    if change < 0:
+        return False
+    if change == 0 and not any(utxo.output.amount.multi_asset for utxo in utxos):
+        return True
+    return change >= min_change_lovelace(utxos)
+
+def _select_largest_first(utxos, total_needed):
+    """Take the largest UTXOs until they cover total_needed with valid change.
+
+    Uses a heap so only the UTXOs actually taken are ordered, instead of
+    sorting the whole wallet.
+    """
+    heap = [(-utxo.output.amount.coin, i, utxo) for i, utxo in enumerate(utxos)]
+    heapq.heapify(heap)
+    
+    selected_utxos = []
+    total_selected = 0
+    while heap and (total_selected < total_needed
+                    or not is_valid_change(selected_utxos, total_selected - total_needed)):
+        neg_coin, _, utxo = heapq.heappop(heap)
+        selected_utxos.append(utxo)
+        total_selected -= neg_coin
+    
+    return selected_utxos, total_selected
+
+def select_utxos(utxos, total_needed):
+    """Select UTXOs covering total_needed lovelace.
+
+    ADA-only UTXOs are preferred so tokens aren't swept into the change
+    output unless they have to be: first an exact match among them (no
+    change at all), then the fewest of them that cover the amount. Only if
+    the ADA-only UTXOs are not enough does the whole wallet get used. A
+    selection is only accepted if its change is valid (see
+    is_valid_change); callers should still check it, since the whole
+    wallet may not be enough. Returns (selected_utxos, total_selected).
+    """
+    ada_only = [utxo for utxo in utxos if not utxo.output.amount.multi_asset]
+    
+    exact_match = _select_exact_match(ada_only, total_needed)
+    if exact_match is not None:
+        return exact_match, total_needed
+    
+    selected_utxos, total_selected = _select_largest_first(ada_only, total_needed)
+    if total_selected >= total_needed and is_valid_change(selected_utxos, total_selected - total_needed):
+        return selected_utxos, total_selected
+    
+    return _select_largest_first(utxos, total_needed)
+
+def plan_batches(df, batch_size):
+    """Summarize df split into consecutive batches of batch_size rows.
+
+    Returns one row per batch with its Start Row (1-based, to match the
+    Start Row setting), recipient count and total ADA, computed with a
+    single groupby rather than slicing each batch.
+    """
+    batch_index = np.arange(len(df)) // batch_size
+    batches = df['Lovelace'].groupby(batch_index).agg(['size', 'sum'])
+    batch_numbers = batches.index.to_numpy()
+    return pd.DataFrame({
+        "Batch": batch_numbers + 1,
+        "Start Row": batch_numbers * batch_size + 1,
+        "Recipients": batches['size'].to_numpy(),
+        "Total ADA": batches['sum'].to_numpy() / LOVELACE_PER_ADA
+    })
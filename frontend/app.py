@@ -1,24 +1,28 @@
 import streamlit as st
 import pandas as pd
+import io
 import json
 import os
+import hashlib
+from collections import Counter, defaultdict
 from pathlib import Path
 from datetime import datetime
-from pycardano import (
-    Address,
-    TransactionBuilder,
-    TransactionOutput,
-    TransactionInput,
-    TransactionBody,
-    TransactionWitnessSet,
-    Transaction,
-    Value,
-    Network,
-    BlockFrostChainContext,
-    AuxiliaryData,
-    Metadata
+
+from airdrop_common import (
+    LOVELACE_PER_ADA,
+    MAINNET_ADDRESS_PREFIX,
+    REQUIRED_COLUMNS,
+    MIN_LOVELACE_PER_OUTPUT,
+    parse_address,
+    validate_csv,
+    select_utxos,
+    is_valid_change,
+    plan_batches
 )
 
+# pycardano is imported inside the functions that build transactions so the
+# page renders without waiting for it (and its cbor/nacl/blockfrost deps)
+
 # Configure Streamlit page
 st.set_page_config(
     page_title="Cardano Airdrop Generator",
@@ -26,121 +30,145 @@ st.set_page_config(
     layout="wide"
 )
 
-def ada_to_lovelace(ada_amount: float) -> int:
-    """Convert ADA to Lovelace."""
-    return int(ada_amount * 1_000_000)
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_chain_context(blockfrost_id):
+    """Return a BlockFrost context for blockfrost_id, shared across reruns.
 
-def validate_csv(df):
-    """Validate the CSV format."""
-    required_columns = ['Address', 'ADA Value']
-    
-    # Check columns exist
-    if not all(col in df.columns for col in required_columns):
-        return False, "CSV must contain 'Address' and 'ADA Value' columns"
-    
-    # Validate addresses
-    invalid_addresses = [addr for addr in df['Address'] if not str(addr).startswith('addr1')]
-    if invalid_addresses:
-        return False, f"Found {len(invalid_addresses)} invalid addresses. All addresses must start with 'addr1'"
-    
-    # Validate ADA amounts
-    try:
-        df['ADA Value'] = pd.to_numeric(df['ADA Value'])
-        if (df['ADA Value'] <= 0).any():
-            return False, "All ADA values must be positive"
-    except:
-        return False, "ADA Value column must contain valid numbers"
-    
-    return True, "CSV validation passed"
+    Constructing one fetches the latest epoch over HTTP, and the context
+    refreshes its own epoch and protocol parameters when they go stale.
+    """
+    from pycardano import BlockFrostChainContext, Network
+    return BlockFrostChainContext(
+        project_id=blockfrost_id,
+        network=Network.MAINNET
+    )
 
-def create_transaction(blockfrost_id, wallet_address, recipients_df, num_recipients=None, metadata_message=None):
+@st.cache_resource(ttl=60, show_spinner=False)
+def fetch_utxos(blockfrost_id, wallet_address):
+    """Query BlockFrost for the UTXOs held at wallet_address.
+
+    Cached for a minute (a few Cardano blocks) so regenerating the same
+    batch doesn't repeat the round trips; use Refresh UTXOs after
+    submitting a transaction. cache_resource rather than cache_data
+    because pycardano's MultiAsset can't be unpickled; callers must not
+    mutate the returned list.
+    """
+    context = get_chain_context(blockfrost_id)
+    return context.utxos(parse_address(wallet_address))
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_csv(file_bytes):
+    """Parse and validate an uploaded CSV, once per distinct file content.
+
+    Streamlit reruns the script on every widget change, so the parsed and
+    validated DataFrame is cached keyed on the file bytes. Returns
+    (df, is_valid, message).
+    """
+    # Only parse the columns the airdrop uses, and keep ADA Value as text so
+    # validate_csv can convert it to lovelace exactly
+    df = pd.read_csv(
+        io.BytesIO(file_bytes),
+        usecols=lambda column: column in REQUIRED_COLUMNS,
+        dtype={'ADA Value': str}
+    )
+    is_valid, message = validate_csv(df)
+    return df, is_valid, message
+
+def create_transaction(blockfrost_id, wallet_address, recipients_df, metadata_message=None, validate_cbor=False, binary_output=False):
     """Create the transaction using PyCardano."""
     try:
-        # Initialize BlockFrost context
-        context = BlockFrostChainContext(
-            project_id=blockfrost_id,
-            network=Network.MAINNET
+        from pycardano import (
+            TransactionOutput,
+            TransactionInput,
+            TransactionBody,
+            TransactionWitnessSet,
+            Transaction,
+            TransactionId,
+            Value,
+            AuxiliaryData,
+            Metadata,
+            MultiAsset,
+            Asset
         )
         
-        # Parse sender address
-        sender_addr = Address.from_primitive(wallet_address)
-        
-        # Get UTXOs
-        utxos = context.utxos(sender_addr)
-        if not utxos:
-            return False, "No UTXOs found for this wallet address"
+        # Parse sender address; the bech32 decode doubles as validation
+        # and the parsed address is reused for the change output
+        wallet_address = wallet_address.strip()
+        try:
+            sender_addr = parse_address(wallet_address)
+        except Exception:
+            return False, f"Invalid wallet address. It must be a valid Cardano mainnet address ({MAINNET_ADDRESS_PREFIX}...)"
         
-        # Prepare recipients
-        if num_recipients:
-            recipients_df = recipients_df.head(num_recipients)
+        # Only two columns are needed, so zip them into plain tuples
+        # instead of materializing a Series per row with iterrows().
+        # Addresses are parsed once here, before any BlockFrost request, so
+        # a bad address fails without a round trip; lovelace was computed
+        # exactly from the CSV text by validate_csv. Bad addresses are
+        # collected and reported together rather than failing on the first.
+        recipients = []
+        invalid_addresses = []
+        for address, lovelace in zip(recipients_df['Address'], recipients_df['Lovelace']):
+            address = str(address).strip()
+            try:
+                recipients.append((parse_address(address), int(lovelace)))
+            except Exception:
+                invalid_addresses.append(address)
+
+        if invalid_addresses:
+            return False, f"Invalid recipient address(es): {', '.join(invalid_addresses[:5])}" + (
+                f" and {len(invalid_addresses) - 5} more" if len(invalid_addresses) > 5 else ""
+            )
         
-        recipients = [
-            {
-                'address': row['Address'].strip(),
-                'ada_amount': float(row['ADA Value'])
-            }
-            for _, row in recipients_df.iterrows()
+        # Get UTXOs
+        utxos = fetch_utxos(blockfrost_id, wallet_address)
+
+        # Create outputs
+        tx_outputs = [
+            TransactionOutput(address=address, amount=Value(coin=lovelace))
+            for address, lovelace in recipients
         ]
-        
+
         # Calculate totals
-        total_ada = sum(r['ada_amount'] for r in recipients)
-        total_lovelace = sum(ada_to_lovelace(r['ada_amount']) for r in recipients)
+        total_lovelace = sum(lovelace for _, lovelace in recipients)
+        total_ada = total_lovelace / LOVELACE_PER_ADA
         estimated_fee = 500000  # Fixed fee: 0.5 ADA
         total_needed = total_lovelace + estimated_fee
         
+        if not utxos:
+            return False, "No UTXOs found for this wallet address"
+        
         # Select UTXOs
-        utxos.sort(key=lambda utxo: utxo.output.amount.coin, reverse=True)
-        selected_utxos = []
-        total_selected = 0
-        for utxo in utxos:
-            selected_utxos.append(utxo)
-            total_selected += utxo.output.amount.coin
-            if total_selected >= total_needed:
-                break
+        selected_utxos, total_selected = select_utxos(utxos, total_needed)
         
         if total_selected < total_needed:
-            return False, f"Insufficient funds. Need {total_needed / 1_000_000:.2f} ADA, have {total_selected / 1_000_000:.2f} ADA"
+            return False, f"Insufficient funds. Need {total_needed / LOVELACE_PER_ADA:.2f} ADA, have {total_selected / LOVELACE_PER_ADA:.2f} ADA"
+        if not is_valid_change(selected_utxos, total_selected - total_needed):
+            return False, "Insufficient funds. The change output would be below the Cardano minimum output amount"
         
         # Create transaction inputs
         tx_inputs = [TransactionInput(utxo.input.transaction_id, utxo.input.index) for utxo in selected_utxos]
         
-        # Create outputs
-        tx_outputs = []
-        for recipient in recipients:
-            output = TransactionOutput(
-                address=Address.from_primitive(recipient['address']),
-                amount=Value(coin=ada_to_lovelace(recipient['ada_amount']))
-            )
-            tx_outputs.append(output)
-        
         # Calculate change - including tokens/NFTs from selected UTXOs
         change_amount = total_selected - total_lovelace - estimated_fee
         
         # Collect all tokens/NFTs from selected UTXOs
-        total_tokens = {}
+        total_tokens = defaultdict(Counter)
         for utxo in selected_utxos:
             if utxo.output.amount.multi_asset:
                 for policy_id, assets in utxo.output.amount.multi_asset.items():
-                    if policy_id not in total_tokens:
-                        total_tokens[policy_id] = {}
-                    for asset_name, quantity in assets.items():
-                        if asset_name not in total_tokens[policy_id]:
-                            total_tokens[policy_id][asset_name] = 0
-                        total_tokens[policy_id][asset_name] += quantity
+                    # Asset isn't a Mapping, so Counter would count its keys
+                    # instead of adding quantities unless given a real dict
+                    total_tokens[policy_id].update(dict(assets.items()))
 
         # Create change output with ADA and tokens/NFTs
         if change_amount > 0 or total_tokens:
             # Build the Value object for change
             if total_tokens:
-                # Create MultiAsset from collected tokens
-                from pycardano import MultiAsset, Asset
-                multi_asset = MultiAsset()
-                for policy_id, assets in total_tokens.items():
-                    # Create Asset object for this policy
-                    asset_obj = Asset()
-                    for asset_name, quantity in assets.items():
-                        asset_obj[asset_name] = quantity
-                    multi_asset[policy_id] = asset_obj
+                # Create MultiAsset from collected tokens, one Asset per policy
+                multi_asset = MultiAsset({
+                    policy_id: Asset(assets)
+                    for policy_id, assets in total_tokens.items()
+                })
                 
                 change_value = Value(coin=max(change_amount, 0), multi_asset=multi_asset)
             else:
@@ -171,55 +199,65 @@ def create_transaction(blockfrost_id, wallet_address, recipients_df, num_recipie
             # Create metadata hash and add it to transaction body
             tx_body.auxiliary_data_hash = auxiliary_data.hash()
         
-        # Create transaction with metadata
-        transaction = Transaction(
-            transaction_body=tx_body,
-            transaction_witness_set=TransactionWitnessSet(),
-            auxiliary_data=auxiliary_data
-        )
-        
-        # Generate and validate CBOR
-        cbor_hex = transaction.to_cbor().hex()
-        test_tx = Transaction.from_cbor(cbor_hex)
+        # Encode the body only once: the transaction ID is its blake2b-256
+        # hash, and the transaction is the CBOR array
+        # [body, witness_set, is_valid, auxiliary_data] wrapped around it
+        body_cbor = tx_body.to_cbor()
+        transaction_id = TransactionId(hashlib.blake2b(body_cbor, digest_size=32).digest())
+        cbor_bytes = b''.join([
+            b'\x84',
+            body_cbor,
+            TransactionWitnessSet().to_cbor(),
+            b'\xf5',
+            auxiliary_data.to_cbor() if auxiliary_data else b'\xf6'
+        ])
         
-        # Create Eternl file
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        eternl_data = {
-            "type": "Tx ConwayEra",
-            "description": f"BOM Airdrop - {len(recipients)} Recipients ({total_ada:.2f} ADA)",
-            "cborHex": cbor_hex
-        }
+        # Re-decoding is a debug-only sanity check since it rebuilds the
+        # whole transaction object tree
+        if validate_cbor:
+            decoded = Transaction.from_cbor(cbor_bytes)
+            if decoded.id != transaction_id:
+                return False, "CBOR validation failed: transaction ID mismatch"
         
         # Create output directory if it doesn't exist
         output_dir = Path("output")
         output_dir.mkdir(exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
         # Save files
-        filename = output_dir / f"airdrop_eternl_{timestamp}.json"
-        with open(filename, 'w') as f:
-            json.dump(eternl_data, f, indent=2)
+        if binary_output:
+            # Raw CBOR is half the size of the hex inside the Eternl JSON
+            filename = output_dir / f"airdrop_{timestamp}.cbor"
+            payload = cbor_bytes
+        else:
+            eternl_data = {
+                "type": "Tx ConwayEra",
+                "description": f"BOM Airdrop - {len(recipients)} Recipients ({total_ada:.2f} ADA)",
+                "cborHex": cbor_bytes.hex()
+            }
+            filename = output_dir / f"airdrop_eternl_{timestamp}.json"
+            # Eternl reads this programmatically, so skip the indentation, and
+            # serialize to one string so the file is written in a single call
+            payload = json.dumps(eternl_data, separators=(',', ':')).encode()
+        # The same bytes are handed to the download button, so the file
+        # never has to be read back
+        filename.write_bytes(payload)
         
-        # Create summary of tokens found
-        token_summary = []
-        for policy_id, assets in total_tokens.items():
-            for asset_name, quantity in assets.items():
-                asset_name_hex = asset_name.payload.hex() if hasattr(asset_name, 'payload') else str(asset_name)
-                token_summary.append({
-                    'policy_id': str(policy_id),
-                    'asset_name': asset_name_hex,
-                    'quantity': quantity
-                })
-
         return True, {
             'filename': str(filename),
-            'transaction_id': transaction.id,
+            'payload': payload,
+            'mime': "application/cbor" if binary_output else "application/json",
+            'transaction_id': transaction_id,
+            'num_recipients': len(recipients),
             'num_inputs': len(tx_inputs),
             'num_outputs': len(tx_outputs),
             'total_ada': total_ada,
-            'fee': estimated_fee / 1_000_000,
-            'change': change_amount / 1_000_000,
-            'tokens_found': len(token_summary),
-            'token_details': token_summary
+            'fee': estimated_fee / LOVELACE_PER_ADA,
+            'change': change_amount / LOVELACE_PER_ADA,
+            # Tokens are left as {policy_id: {asset_name: quantity}}; the
+            # UI flattens them straight into its table
+            'tokens_found': sum(len(assets) for assets in total_tokens.values()),
+            'tokens': total_tokens
         }
         
     except Exception as e:
@@ -239,7 +277,7 @@ with st.sidebar:
     # Wallet address
     wallet_address = st.text_input(
         "Wallet Address",
-        help="Your wallet address (starts with 'addr1')"
+        help=f"Your wallet address (starts with '{MAINNET_ADDRESS_PREFIX}')"
     )
     
     # Number of recipients
@@ -250,6 +288,14 @@ with st.sidebar:
         value=5,
         help="Number of recipients to process from the CSV"
     )
+    
+    # Starting row, so a large CSV can be processed in batches
+    start_row = st.number_input(
+        "Start Row",
+        min_value=1,
+        value=1,
+        help="First CSV row to process (1 = first recipient). Advance by the number of recipients to generate the next batch."
+    )
 
     # Metadata message
     metadata_message = st.text_area(
@@ -258,11 +304,28 @@ with st.sidebar:
         placeholder="Enter your message here..."
     )
     
+    # Debug option
+    validate_cbor = st.checkbox(
+        "Re-decode CBOR (debug)",
+        help="Decode the generated transaction again as a sanity check. Slower for large airdrops."
+    )
+    
+    # Output format
+    binary_output = st.checkbox(
+        "Binary CBOR output",
+        help="Save the raw transaction CBOR (.cbor) instead of the Eternl JSON file, for tools that import CBOR directly."
+    )
+    
     # Save settings
     if st.button("💾 Save Settings"):
         st.session_state.blockfrost_id = blockfrost_id
         st.session_state.wallet_address = wallet_address
         st.success("Settings saved!")
+    
+    # Drop cached UTXOs, e.g. after submitting the previous batch
+    if st.button("🔄 Refresh UTXOs", help="Wallet UTXOs are cached for up to a minute. Refresh after submitting a transaction."):
+        fetch_utxos.clear()
+        st.success("UTXO cache cleared!")
 
 # Main content
 st.title("🚀 Cardano Airdrop Generator")
@@ -277,8 +340,7 @@ uploaded_file = st.file_uploader(
 
 if uploaded_file:
     # Read and validate CSV
-    df = pd.read_csv(uploaded_file)
-    is_valid, message = validate_csv(df)
+    df, is_valid, message = load_csv(uploaded_file.getvalue())
     
     if is_valid:
         st.success("✅ CSV validation passed")
@@ -289,7 +351,7 @@ if uploaded_file:
         with col1:
             st.metric("Total Recipients", len(df))
         with col2:
-            st.metric("Total ADA", f"{df['ADA Value'].sum():.2f}")
+            st.metric("Total ADA", f"{df['Lovelace'].sum() / LOVELACE_PER_ADA:.2f}")
         with col3:
             st.metric("Processing", num_recipients)
         
@@ -300,29 +362,48 @@ if uploaded_file:
             hide_index=True,
             column_config={
                 "Address": st.column_config.TextColumn("Recipient Address"),
-                "ADA Value": st.column_config.NumberColumn("ADA Amount", format="%.2f")
+                "ADA Value": st.column_config.NumberColumn("ADA Amount", format="%.2f"),
+                "Lovelace": None
             }
         )
         
+        # Show how the CSV splits into transactions when it exceeds one batch
+        if len(df) > num_recipients:
+            st.subheader("🧮 Batch Plan")
+            st.caption("Each batch is one transaction. Set Start Row in the sidebar to generate it.")
+            batch_plan = plan_batches(df, num_recipients)
+            st.dataframe(
+                batch_plan,
+                hide_index=True,
+                column_config={
+                    "Total ADA": st.column_config.NumberColumn("Total ADA", format="%.2f")
+                }
+            )
+        
         # Show subset that will be processed
-        st.subheader(f"🎯 Processing First {num_recipients} Recipients")
-        subset_df = df.head(num_recipients)
+        start_idx = start_row - 1
+        subset_df = df.iloc[start_idx:start_idx + num_recipients]
+        st.subheader(f"🎯 Processing Rows {start_row} to {start_idx + len(subset_df)}")
         st.dataframe(
             subset_df,
             hide_index=True,
             column_config={
                 "Address": st.column_config.TextColumn("Recipient Address"),
-                "ADA Value": st.column_config.NumberColumn("ADA Amount", format="%.5f")
+                "ADA Value": st.column_config.NumberColumn("ADA Amount", format="%.5f"),
+                "Lovelace": None
             }
         )
-        st.metric("Subset Total ADA", f"{subset_df['ADA Value'].sum():.2f}")
+        st.metric("Subset Total ADA", f"{subset_df['Lovelace'].sum() / LOVELACE_PER_ADA:.2f}")
 
         # Check for outputs below minimum ADA
-        MIN_ADA_PER_OUTPUT = 0.96975
-        too_small = subset_df[subset_df['ADA Value'] < MIN_ADA_PER_OUTPUT]
-        if not too_small.empty:
-            st.error(f"❌ {len(too_small)} outputs are below the Cardano minimum of {MIN_ADA_PER_OUTPUT} ADA per output. Please fix your CSV.")
-            st.dataframe(too_small, hide_index=True)
+        MIN_ADA_PER_OUTPUT = MIN_LOVELACE_PER_OUTPUT / LOVELACE_PER_ADA
+        # Compare the exact on-chain amounts as a plain array; the offending
+        # rows are only sliced out when there are any
+        too_small_mask = subset_df['Lovelace'].to_numpy() < MIN_LOVELACE_PER_OUTPUT
+        num_too_small = int(too_small_mask.sum())
+        if num_too_small:
+            st.error(f"❌ {num_too_small} outputs are below the Cardano minimum of {MIN_ADA_PER_OUTPUT} ADA per output. Please fix your CSV.")
+            st.dataframe(subset_df[too_small_mask], hide_index=True, column_config={"Lovelace": None})
         
         # Show metadata preview if provided
         if metadata_message and metadata_message.strip():
@@ -339,16 +420,19 @@ if uploaded_file:
         if st.button("🔥 Generate Transaction"):
             if not blockfrost_id or not wallet_address:
                 st.error("Please enter Blockfrost ID and wallet address in the sidebar")
-            elif not too_small.empty:
-                st.error(f"Cannot generate transaction: {len(too_small)} outputs are below the minimum ADA per output.")
+            elif subset_df.empty:
+                st.error(f"Start row {start_row} is past the end of the CSV ({len(df)} rows)")
+            elif num_too_small:
+                st.error(f"Cannot generate transaction: {num_too_small} outputs are below the minimum ADA per output.")
             else:
                 with st.spinner("Generating transaction..."):
                     success, result = create_transaction(
                         blockfrost_id,
                         wallet_address,
-                        df,
-                        num_recipients,
-                        metadata_message if metadata_message.strip() else None
+                        subset_df,
+                        metadata_message=metadata_message if metadata_message.strip() else None,
+                        validate_cbor=validate_cbor,
+                        binary_output=binary_output
                     )
                 
                 if success:
@@ -358,7 +442,7 @@ if uploaded_file:
                     st.subheader("📝 Transaction Details")
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.metric("Recipients", result['num_outputs'] - 1)  # Subtract change output
+                        st.metric("Recipients", result['num_recipients'])
                         st.metric("Total ADA", f"{result['total_ada']:.2f}")
                     with col2:
                         st.metric("Inputs", result['num_inputs'])
@@ -375,13 +459,18 @@ if uploaded_file:
                         st.info(f"Found {result['tokens_found']} token(s)/NFT(s) that will be returned to your wallet in the change output.")
                         
                         # Display token details in a table
-                        if result.get('token_details'):
-                            token_df = pd.DataFrame(result['token_details'])
-                            token_df['short_policy'] = token_df['policy_id'].str[:20] + "..."
-                            token_df['short_asset'] = token_df['asset_name'].str[:20] + "..."
+                        if result.get('tokens'):
+                            token_df = pd.DataFrame(
+                                (
+                                    (str(policy_id)[:20] + "...", asset_name.payload.hex()[:20] + "...", quantity)
+                                    for policy_id, assets in result['tokens'].items()
+                                    for asset_name, quantity in assets.items()
+                                ),
+                                columns=['short_policy', 'short_asset', 'quantity']
+                            )
                             
                             st.dataframe(
-                                token_df[['short_policy', 'short_asset', 'quantity']],
+                                token_df,
                                 hide_index=True,
                                 column_config={
                                     "short_policy": st.column_config.TextColumn("Policy ID"),
@@ -393,18 +482,27 @@ if uploaded_file:
                         st.info("ℹ️ No tokens/NFTs found in your UTXOs - only ADA will be processed.")
                     
                     # Download button
-                    with open(result['filename'], 'r') as f:
-                        st.download_button(
-                            "📥 Download Eternl Transaction",
-                            f.read(),
-                            file_name=os.path.basename(result['filename']),
-                            mime="application/json",
-                            help="Import this file into Eternl wallet"
-                        )
+                    st.download_button(
+                        "📥 Download Transaction CBOR" if binary_output else "📥 Download Eternl Transaction",
+                        result['payload'],
+                        file_name=os.path.basename(result['filename']),
+                        mime=result['mime'],
+                        help="Unsigned transaction as raw CBOR" if binary_output else "Import this file into Eternl wallet"
+                    )
                     
                     # Instructions
                     st.subheader("📋 Next Steps")
-                    st.write("""
+                    if binary_output:
+                        st.write("""
+                    1. Download the transaction file
+                    2. Load the raw CBOR into a tool that accepts unsigned transaction CBOR
+                    3. Review all details carefully
+                    4. Sign and submit the transaction
+
+                    Eternl's Transaction Importer expects the JSON file instead: untick "Binary CBOR output" and generate again to import into Eternl.
+                    """)
+                    else:
+                        st.write("""
                     1. Download the transaction file
                     2. Open Eternl wallet
                     3. Go to Transaction Importer